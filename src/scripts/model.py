@@ -3,8 +3,12 @@ import pandas as pd
 from sklearn.preprocessing import StandardScaler
 from sklearn.ensemble import RandomForestClassifier, RandomForestRegressor
 from sklearn.model_selection import train_test_split, GridSearchCV
+from sklearn.base import clone
+from datetime import datetime
 import joblib
 import json
+import copy
+import os
 
 class ICUModel:
     def __init__(self):
@@ -37,6 +41,12 @@ class ICUModel:
             random_state=42
         )
         self.feature_importance = None
+        # Stays the ensembles have been fit on, and held-out scores from the
+        # last full retrain that the drift check compares against
+        self.seen_stays = []
+        self.reference_scores = None
+        # Seeds the trees grown by each incremental update
+        self.n_updates = 0
         
     def preprocess_data(self, df):
         # Convert timestamps to datetime
@@ -170,6 +180,14 @@ class ICUModel:
             'los_mse': np.mean((self.los_model.predict(X_scaled) - y_los) ** 2)
         }
     
+    def refit(self, X, y_mortality, y_decompensation, y_los):
+        """Refit the tuned models on X without repeating the grid search"""
+        X_scaled = self.scaler.fit_transform(X)
+        self.mortality_model.fit(X_scaled, y_mortality)
+        self.decompensation_model.fit(X_scaled, y_decompensation)
+        self.los_model.fit(X_scaled, y_los)
+        self.calculate_feature_importance()
+
     def predict(self, X):
         X_scaled = self.scaler.transform(X)
         return {
@@ -177,7 +195,195 @@ class ICUModel:
             'decompensation': self.decompensation_model.predict_proba(X_scaled)[:, 1],
             'los': self.los_model.predict(X_scaled)
         }
-    
+
+    def evaluate(self, X, y_mortality, y_decompensation, y_los):
+        """Score all three models on data they were not trained on"""
+        X_scaled = self.scaler.transform(X)
+        return {
+            'mortality_score': float(self.mortality_model.score(X_scaled, y_mortality)),
+            'decompensation_score': float(self.decompensation_model.score(X_scaled, y_decompensation)),
+            'los_score': float(self.los_model.score(X_scaled, y_los))
+        }
+
+    def check_drift(self, X, y_mortality, y_decompensation, y_los,
+                    score_tolerance=0.05, shift_tolerance=4.0, min_score_stays=50):
+        """Decide whether held-out stays call for a full retrain.
+
+        Drift is flagged when a classifier sees a class it was never trained
+        on, when the mean of any feature is more than `shift_tolerance`
+        standard errors from the scaler's running mean, or, once the batch
+        holds at least `min_score_stays` stays, when any model scores more
+        than `score_tolerance` below its reference score. Smaller batches are
+        not scored, as their scores are too noisy to compare against the
+        reference.
+        """
+        # Both the batch mean and the running mean are estimates
+        n_seen = np.max(self.scaler.n_samples_seen_)
+        standard_error = self.scaler.scale_ * np.sqrt(1 / len(X) + 1 / n_seen)
+        feature_shift = np.abs(np.mean(X, axis=0) - self.scaler.mean_) / standard_error
+
+        scores = None
+        score_drops = {}
+        if len(X) >= min_score_stays:
+            scores = self.evaluate(X, y_mortality, y_decompensation, y_los)
+        if scores is not None and self.reference_scores is not None:
+            score_drops = {
+                name: self.reference_scores[name] - score
+                for name, score in scores.items()
+                if name in self.reference_scores
+            }
+
+        unknown = self.unknown_classes(y_mortality, y_decompensation)
+        drifted = (
+            bool(unknown)
+            or any(drop > score_tolerance for drop in score_drops.values())
+            or bool(np.max(feature_shift) > shift_tolerance)
+        )
+
+        return {
+            'drift': drifted,
+            'unknown_classes': unknown,
+            'scores': scores,
+            'score_drops': score_drops,
+            'max_feature_shift': float(np.max(feature_shift))
+        }
+
+    def update(self, X, y_mortality, y_decompensation, y_los,
+               stay_ids=None, n_new_trees=None, retire='oldest'):
+        """Fold newly arrived stays into the existing ensembles.
+
+        The scaler is refreshed from running statistics, trees fit on the new
+        stays are appended to each forest, and the same number of trees is
+        retired so the ensemble size stays fixed. Existing trees have their
+        split thresholds remapped to the refreshed scaling, so their
+        decisions are unchanged. With `retire='weakest'` the retired trees
+        are the existing ones that score worst on the new stays, which none
+        of them have seen; otherwise the oldest trees are dropped. Batches
+        reported by `missing_classes` or `unknown_classes` are rejected
+        before anything changes.
+        """
+        if retire not in ('oldest', 'weakest'):
+            raise ValueError(f"Unknown retirement strategy: {retire}")
+        if n_new_trees is not None and n_new_trees < 1:
+            raise ValueError("n_new_trees must be at least 1")
+
+        # Without a stay history the new batch would look like all the data
+        # and replace every tree
+        if not self.seen_stays:
+            raise ValueError("Incremental update needs the stays the model was trained on")
+
+        missing = self.missing_classes(y_mortality, y_decompensation)
+        if missing:
+            raise ValueError(f"New stays lack known classes for: {', '.join(missing)}")
+        unknown = self.unknown_classes(y_mortality, y_decompensation)
+        if unknown:
+            raise ValueError(f"New stays have unknown classes for: {', '.join(unknown)}")
+
+        # Fit everything before changing anything, so a failure part way
+        # through leaves the scaler and trees in step
+        scaler = copy.deepcopy(self.scaler)
+        scaler.partial_fit(X)
+        X_scaled = scaler.transform(X)
+        X_old_scaled = self.scaler.transform(X)
+
+        # By default each forest gives the new stays the share of trees
+        # matching their share of all stays seen so far
+        share = len(X) / (len(self.seen_stays) + len(X))
+
+        added = {}
+        grown = []
+        for name, forest, y in [('mortality', self.mortality_model, y_mortality),
+                                ('decompensation', self.decompensation_model, y_decompensation),
+                                ('los', self.los_model, y_los)]:
+            n_trees = n_new_trees
+            if n_trees is None:
+                n_trees = max(1, int(round(forest.n_estimators * share)))
+            n_trees = min(n_trees, forest.n_estimators)
+            kept, new_trees = self._grow_forest(forest, X_old_scaled, X_scaled, y,
+                                                n_trees, retire, seed=42 + self.n_updates + 1)
+            grown.append((forest, kept, new_trees))
+            added[name] = n_trees
+
+        old_mean = self.scaler.mean_
+        old_scale = self.scaler.scale_
+        self.scaler = scaler
+        for forest, kept, new_trees in grown:
+            for tree in kept:
+                self._rescale_tree(tree, old_mean, old_scale)
+            forest.estimators_ = kept + new_trees
+            forest.n_estimators = len(forest.estimators_)
+        self.n_updates += 1
+
+        if stay_ids is not None:
+            self.seen_stays.extend(pd.Series(stay_ids).tolist())
+
+        self.calculate_feature_importance()
+        return added
+
+    def missing_classes(self, y_mortality, y_decompensation):
+        """Name the classifiers whose known classes are not all in a batch.
+
+        Trees fit without every known class would return probability columns
+        that do not line up with the rest of the forest, so such batches
+        have to wait for more stays before they can be folded in.
+        """
+        return [
+            name for name, forest, y in [('mortality', self.mortality_model, y_mortality),
+                                         ('decompensation', self.decompensation_model, y_decompensation)]
+            if len(np.setdiff1d(forest.classes_, y))
+        ]
+
+    def unknown_classes(self, y_mortality, y_decompensation):
+        """Name the classifiers that see a class they were never trained on.
+
+        Appended trees cannot add probability columns to a forest, so only a
+        full retrain can take such stays in.
+        """
+        return [
+            name for name, forest, y in [('mortality', self.mortality_model, y_mortality),
+                                         ('decompensation', self.decompensation_model, y_decompensation)]
+            if len(np.setdiff1d(y, forest.classes_))
+        ]
+
+    def _rescale_tree(self, tree, old_mean, old_scale):
+        # Map each split threshold back to raw units, then into the refreshed
+        # scaling. StandardScaler is a monotonic per-feature transform, so
+        # every sample still takes the same path through the tree.
+        internal = tree.tree_.feature >= 0
+        features = tree.tree_.feature[internal]
+        thresholds = tree.tree_.threshold
+        raw = thresholds[internal] * old_scale[features] + old_mean[features]
+        thresholds[internal] = (raw - self.scaler.mean_[features]) / self.scaler.scale_[features]
+
+    def _grow_forest(self, forest, X_old_scaled, X_scaled, y, n_new_trees, retire, seed):
+        # Returns the existing trees to keep and the new trees to append,
+        # leaving the forest itself untouched
+        is_classifier = hasattr(forest, 'classes_')
+
+        new_forest = clone(forest).set_params(
+            n_estimators=n_new_trees,
+            warm_start=False,
+            random_state=seed
+        )
+        new_forest.fit(X_scaled, y)
+
+        existing = list(forest.estimators_)
+        if retire == 'weakest':
+            # Existing trees still split on the scaling they were fit with
+            tree_scores = []
+            for tree in existing:
+                if is_classifier:
+                    predicted = forest.classes_.take(tree.predict(X_old_scaled).astype(int))
+                    tree_scores.append(np.mean(predicted == y))
+                else:
+                    tree_scores.append(-np.mean((tree.predict(X_old_scaled) - y) ** 2))
+            keep = np.sort(np.argsort(tree_scores)[n_new_trees:])
+            existing = [existing[i] for i in keep]
+        else:
+            existing = existing[n_new_trees:]
+
+        return existing, list(new_forest.estimators_)
+
     def calculate_feature_importance(self):
         feature_names = [
             'HR_mean', 'HR_std', 'HR_min', 'HR_max', 'HR_median', 'HR_25th', 'HR_75th', 'HR_var', 'HR_trend',
@@ -209,6 +415,13 @@ class ICUModel:
         
         with open(f'{path_prefix}_feature_importance.json', 'w') as f:
             json.dump(self.feature_importance, f)
+
+        with open(f'{path_prefix}_metadata.json', 'w') as f:
+            json.dump({
+                'seen_stays': self.seen_stays,
+                'reference_scores': self.reference_scores,
+                'n_updates': self.n_updates
+            }, f)
     
     def load_model(self, path_prefix):
         self.mortality_model = joblib.load(f'{path_prefix}_mortality.joblib')
@@ -219,25 +432,158 @@ class ICUModel:
         with open(f'{path_prefix}_feature_importance.json', 'r') as f:
             self.feature_importance = json.load(f)
 
-def main():
-    # Load and preprocess data
-    data_path = "processed_patient_data.csv"
-    df = pd.read_csv(data_path)
-    
+        # Models saved before incremental updates existed have no metadata
+        if os.path.exists(f'{path_prefix}_metadata.json'):
+            with open(f'{path_prefix}_metadata.json', 'r') as f:
+                metadata = json.load(f)
+            self.seen_stays = metadata['seen_stays']
+            self.reference_scores = metadata['reference_scores']
+            self.n_updates = metadata.get('n_updates', 0)
+
+
+class ModelRegistry:
+    """Versioned store of saved ICUModels.
+
+    Each version lives in its own directory under `root`, and `registry.json`
+    records whether it came from a full retrain or an incremental update,
+    which version an incremental update was applied to, and its scores.
+    """
+
+    def __init__(self, root='model_registry'):
+        self.root = root
+        self.index_path = os.path.join(root, 'registry.json')
+        if os.path.exists(self.index_path):
+            with open(self.index_path, 'r') as f:
+                self.versions = json.load(f)
+        else:
+            self.versions = []
+
+    def latest_version(self):
+        return self.versions[-1]['version'] if self.versions else None
+
+    def _path_prefix(self, version):
+        return os.path.join(self.root, f'v{version:04d}', 'icu_model')
+
+    def register(self, model, kind, metrics=None, parent=None):
+        version = len(self.versions) + 1
+        path_prefix = self._path_prefix(version)
+        os.makedirs(os.path.dirname(path_prefix), exist_ok=True)
+        model.save_model(path_prefix)
+
+        self.versions.append({
+            'version': version,
+            'kind': kind,
+            'parent': parent,
+            'created_at': datetime.now().isoformat(timespec='seconds'),
+            'n_stays': len(model.seen_stays),
+            'metrics': metrics or {}
+        })
+        with open(self.index_path, 'w') as f:
+            json.dump(self.versions, f, indent=2)
+        return version
+
+    def load(self, version=None):
+        if version is None:
+            version = self.latest_version()
+        if version is None:
+            raise ValueError("Model registry is empty")
+        model = ICUModel()
+        model.load_model(self._path_prefix(version))
+        return model
+
+def full_retrain(df_processed, registry):
     model = ICUModel()
-    df_processed = model.preprocess_data(df)
     
     # Create features and labels
     X, y_mortality, y_decompensation, y_los = model.create_features(df_processed)
     
+    # Hold out stays to score later incremental updates against
+    (X_train, X_holdout,
+     y_mortality_train, y_mortality_holdout,
+     y_decompensation_train, y_decompensation_holdout,
+     y_los_train, y_los_holdout) = train_test_split(X, y_mortality, y_decompensation, y_los,
+                                                    test_size=0.2, random_state=42)
+    
     # Train model
-    scores = model.train(X, y_mortality, y_decompensation, y_los)
+    scores = model.train(X_train, y_mortality_train, y_decompensation_train, y_los_train)
+    model.reference_scores = model.evaluate(X_holdout, y_mortality_holdout,
+                                            y_decompensation_holdout, y_los_holdout)
+    
+    # The holdout has served its purpose, so deploy models fit on every stay
+    model.refit(X, y_mortality, y_decompensation, y_los)
+    model.seen_stays = df_processed['patientunitstayid'].unique().tolist()
     
     print("Model Performance:")
     print(f"Mortality AUC: {scores['mortality_score']:.3f}")
     print(f"Decompensation AUC: {scores['decompensation_score']:.3f}")
     print(f"Length of Stay MSE: {scores['los_mse']:.3f}")
     
+    version = registry.register(model, 'full', {
+        'train': {name: float(score) for name, score in scores.items()},
+        'holdout': model.reference_scores
+    })
+    print(f"Registered full retrain as version {version}")
+    return model
+
+def incremental_update(df_processed, registry):
+    parent = registry.latest_version()
+    model = registry.load(parent)
+    if not model.seen_stays:
+        print(f"Version {parent} has no stay history, running full retrain")
+        return full_retrain(df_processed, registry)
+    
+    new_df = df_processed[~df_processed['patientunitstayid'].isin(set(model.seen_stays))]
+    if len(new_df) == 0:
+        print(f"No new stays since version {parent}")
+        return model
+    
+    X_new, y_mortality, y_decompensation, y_los = model.create_features(new_df)
+    
+    # New stays are unseen by every tree, so they double as held-out data
+    drift = model.check_drift(X_new, y_mortality, y_decompensation, y_los)
+    if drift['drift']:
+        print(f"Drift detected (max feature shift {drift['max_feature_shift']:.3f}, "
+              f"unknown classes for: {', '.join(drift['unknown_classes']) or 'none'}), "
+              "running full retrain")
+        return full_retrain(df_processed, registry)
+    
+    # Leave the stays unseen so the next run pools them with later arrivals
+    missing = model.missing_classes(y_mortality, y_decompensation)
+    if missing:
+        print(f"Holding {len(X_new)} new stays until every class is present "
+              f"for: {', '.join(missing)}")
+        return model
+    
+    added = model.update(X_new, y_mortality, y_decompensation, y_los,
+                         stay_ids=new_df['patientunitstayid'].unique())
+    
+    if drift['scores'] is not None:
+        print("Held-out Performance on New Stays:")
+        print(f"Mortality Accuracy: {drift['scores']['mortality_score']:.3f}")
+        print(f"Decompensation Accuracy: {drift['scores']['decompensation_score']:.3f}")
+        print(f"Length of Stay R2: {drift['scores']['los_score']:.3f}")
+    
+    version = registry.register(model, 'incremental', {
+        'holdout': drift['scores'],
+        'max_feature_shift': drift['max_feature_shift'],
+        'trees_added': added
+    }, parent=parent)
+    print(f"Registered incremental update of {len(X_new)} stays as version {version}")
+    return model
+
+def main():
+    # Load and preprocess data
+    data_path = "processed_patient_data.csv"
+    df = pd.read_csv(data_path)
+    df_processed = ICUModel().preprocess_data(df)
+    
+    # Only refit from scratch when there is no registered model yet
+    registry = ModelRegistry()
+    if registry.latest_version() is None:
+        model = full_retrain(df_processed, registry)
+    else:
+        model = incremental_update(df_processed, registry)
+    
     # Save model
     model.save_model('icu_model')
     
@@ -0,0 +1,225 @@
+import warnings
+import numpy as np
+import pandas as pd
+import pytest
+from sklearn.ensemble import RandomForestClassifier, RandomForestRegressor
+import model as model_module
+from model import ICUModel, ModelRegistry
+
+
+def make_data(n, seed):
+    rng = np.random.default_rng(seed)
+    X = rng.normal(5, 2, (n, 77))
+    return (X,
+            (X[:, 0] > 5).astype(int),
+            (X[:, 1] > 5).astype(int),
+            X[:, 2] * 3)
+
+
+def make_model():
+    model = ICUModel()
+    model.mortality_model = RandomForestClassifier(n_estimators=10, random_state=42)
+    model.decompensation_model = RandomForestClassifier(n_estimators=10, random_state=42)
+    model.los_model = RandomForestRegressor(n_estimators=10, random_state=42)
+
+    X, y_mortality, y_decompensation, y_los = make_data(100, seed=0)
+    X_scaled = model.scaler.fit_transform(X)
+    model.mortality_model.fit(X_scaled, y_mortality)
+    model.decompensation_model.fit(X_scaled, y_decompensation)
+    model.los_model.fit(X_scaled, y_los)
+    model.calculate_feature_importance()
+    model.seen_stays = list(range(100))
+    return model
+
+
+def test_rescale_keeps_predictions():
+    model = make_model()
+    X, _, _, _ = make_data(50, seed=1)
+    before = model.predict(X)
+
+    old_mean = model.scaler.mean_.copy()
+    old_scale = model.scaler.scale_.copy()
+    model.scaler.partial_fit(make_data(30, seed=2)[0] + 3)
+    for forest in [model.mortality_model, model.decompensation_model, model.los_model]:
+        for tree in forest.estimators_:
+            model._rescale_tree(tree, old_mean, old_scale)
+
+    after = model.predict(X)
+    for name in before:
+        np.testing.assert_allclose(after[name], before[name])
+
+
+@pytest.mark.parametrize('retire', ['oldest', 'weakest'])
+def test_update_keeps_ensemble_size(retire):
+    model = make_model()
+    X, y_mortality, y_decompensation, y_los = make_data(40, seed=3)
+
+    added = model.update(X, y_mortality, y_decompensation, y_los,
+                         stay_ids=range(100, 140), retire=retire)
+
+    assert all(n > 0 for n in added.values())
+    for forest in [model.mortality_model, model.decompensation_model, model.los_model]:
+        assert len(forest.estimators_) == 10
+        assert forest.n_estimators == 10
+    assert len(model.seen_stays) == 140
+
+
+def test_registry_records_versions(tmp_path):
+    registry = ModelRegistry(str(tmp_path))
+    model = make_model()
+    assert registry.register(model, 'full') == 1
+
+    X, y_mortality, y_decompensation, y_los = make_data(20, seed=4)
+    model.update(X, y_mortality, y_decompensation, y_los, stay_ids=range(100, 120))
+    assert registry.register(model, 'incremental', parent=1) == 2
+
+    reloaded = ModelRegistry(str(tmp_path))
+    assert [(v['version'], v['kind'], v['parent'], v['n_stays']) for v in reloaded.versions] == [
+        (1, 'full', None, 100),
+        (2, 'incremental', 1, 120)
+    ]
+    loaded = reloaded.load()
+    assert loaded.seen_stays == model.seen_stays
+    assert loaded.n_updates == 1
+
+
+def test_check_drift_flags_feature_shift():
+    model = make_model()
+    X, y_mortality, y_decompensation, y_los = make_data(60, seed=5)
+
+    assert not model.check_drift(X, y_mortality, y_decompensation, y_los)['drift']
+    shifted = X.copy()
+    shifted[:, 0] += 2
+    assert model.check_drift(shifted, y_mortality, y_decompensation, y_los)['drift']
+
+
+def test_check_drift_only_scores_large_batches():
+    model = make_model()
+    model.reference_scores = {'mortality_score': 2.0,
+                              'decompensation_score': 2.0,
+                              'los_score': 2.0}
+    X, y_mortality, y_decompensation, y_los = make_data(60, seed=6)
+
+    with warnings.catch_warnings():
+        warnings.simplefilter('error')
+        small = model.check_drift(X[:1], y_mortality[:1], y_decompensation[:1], y_los[:1])
+    assert small['scores'] is None
+    assert not small['drift']
+
+    large = model.check_drift(X, y_mortality, y_decompensation, y_los)
+    assert large['scores'] is not None
+    assert large['drift']
+
+
+def test_missing_and_unknown_classes():
+    model = make_model()
+    zeros = np.zeros(5, dtype=int)
+    assert model.missing_classes(zeros, np.array([0, 1, 0, 1, 0])) == ['mortality']
+    assert model.unknown_classes(zeros, np.array([0, 1, 0, 1, 0])) == []
+
+    X, _, y_decompensation, y_los = make_data(5, seed=7)
+    with_new_class = np.array([0, 1, 2, 0, 1])
+    assert model.missing_classes(with_new_class, y_decompensation) == []
+    assert model.unknown_classes(with_new_class, y_decompensation) == ['mortality']
+    drift = model.check_drift(X, with_new_class, y_decompensation, y_los)
+    assert drift['drift']
+    assert drift['unknown_classes'] == ['mortality']
+
+
+def test_update_rejects_bad_input_without_changes():
+    model = make_model()
+    mean = model.scaler.mean_.copy()
+    X, y_mortality, y_decompensation, y_los = make_data(20, seed=8)
+
+    with pytest.raises(ValueError):
+        model.update(X, y_mortality, y_decompensation, y_los, n_new_trees=0)
+    with pytest.raises(ValueError):
+        model.update(X, np.zeros(20, dtype=int), y_decompensation, y_los)
+
+    np.testing.assert_array_equal(model.scaler.mean_, mean)
+    assert model.n_updates == 0
+    assert len(model.seen_stays) == 100
+
+
+def fake_create_features(self, df):
+    # Stay ids seed their own features; a 'mortality' column overrides the
+    # labels derived from them
+    stays = df.drop_duplicates('patientunitstayid')
+    X = np.array([np.random.default_rng(stay).normal(5, 2, 77)
+                  for stay in stays['patientunitstayid']])
+    y_mortality = (stays['mortality'].values if 'mortality' in stays
+                   else (X[:, 0] > 5).astype(int))
+    return X, y_mortality, (X[:, 1] > 5).astype(int), X[:, 2] * 3
+
+
+@pytest.fixture
+def registry(tmp_path, monkeypatch):
+    monkeypatch.setattr(ICUModel, 'create_features', fake_create_features)
+    retrains = []
+    monkeypatch.setattr(model_module, 'full_retrain',
+                        lambda df, registry: retrains.append(df) or 'retrained')
+    registry = ModelRegistry(str(tmp_path))
+    registry.register(make_model(), 'full')
+    registry.retrains = retrains
+    return registry
+
+
+def test_incremental_update_registers_new_stays(registry):
+    df = pd.DataFrame({'patientunitstayid': range(100, 130)})
+
+    updated = model_module.incremental_update(df, registry)
+
+    assert registry.latest_version() == 2
+    assert registry.versions[-1]['kind'] == 'incremental'
+    assert registry.versions[-1]['parent'] == 1
+    assert len(updated.seen_stays) == 130
+
+    model_module.incremental_update(df, registry)
+    assert registry.latest_version() == 2
+
+
+def test_incremental_update_holds_batch_missing_a_class(registry):
+    df = pd.DataFrame({'patientunitstayid': range(100, 110), 'mortality': 0})
+
+    held = model_module.incremental_update(df, registry)
+
+    assert registry.latest_version() == 1
+    assert not registry.retrains
+    assert len(held.seen_stays) == 100
+
+
+def test_incremental_update_retrains_on_unknown_class(registry):
+    df = pd.DataFrame({'patientunitstayid': range(100, 110),
+                       'mortality': [0, 1, 2, 0, 1, 0, 1, 0, 1, 0]})
+
+    assert model_module.incremental_update(df, registry) == 'retrained'
+    assert len(registry.retrains) == 1
+
+
+def test_incremental_update_retrains_without_stay_history(registry):
+    model = registry.load()
+    model.seen_stays = []
+    registry.register(model, 'full')
+    df = pd.DataFrame({'patientunitstayid': range(100, 110)})
+
+    assert model_module.incremental_update(df, registry) == 'retrained'
+
+
+def test_full_retrain_fits_every_stay(tmp_path, monkeypatch):
+    monkeypatch.setattr(ICUModel, 'create_features', fake_create_features)
+    monkeypatch.setattr(
+        ICUModel, 'optimize_hyperparameters',
+        lambda self, X, y, model_type: (RandomForestRegressor(n_estimators=5, random_state=42)
+                                        if model_type == 'los'
+                                        else RandomForestClassifier(n_estimators=5, random_state=42)))
+    registry = ModelRegistry(str(tmp_path))
+    df = pd.DataFrame({'patientunitstayid': range(50)})
+
+    model = model_module.full_retrain(df, registry)
+
+    assert model.seen_stays == list(range(50))
+    assert model.scaler.n_samples_seen_ == 50
+    assert model.reference_scores is not None
+    assert [(v['kind'], v['parent'], v['n_stays']) for v in registry.versions] == [
+        ('full', None, 50)
+    ]